@@ -1,6 +1,7 @@
 # encoding: utf-8
 
-from struct import Struct as SStruct, unpack, pack
+from struct import Struct as SStruct, unpack, pack, error as StructError
+from collections import OrderedDict
 import logging
 import sys
 
@@ -12,6 +13,7 @@ if sys.version_info>(3,0,0):
     python3 = True
     # There isn't long on python3 anymore
     long = int
+    intern = sys.intern
 
 class BinMsgException(Exception):
     pass
@@ -25,6 +27,12 @@ class CannotUnpack(BinMsgException):
 class CannotPack(BinMsgException):
     pass
 
+class LimitExceeded(CannotUnpack, CannotPack):
+    """
+    Frame or string is longer than configured maximum.
+    """
+    pass
+
 class BinStruct(object):
     _format = '!c'
     _type = None
@@ -53,6 +61,27 @@ class BinStruct(object):
     def pack(self, string):
         return self.struct.pack(string)
 
+    def prepare(self, string):
+        """
+        Convert validated value to form pack, packed_size and pack_into
+        accept without converting it again, eg. encode strings.
+        """
+        return string
+
+    def packed_size(self, string):
+        """
+        Return number of bytes pack would produce for given value
+        """
+        return self.size
+
+    def pack_into(self, buffer, offset, string):
+        """
+        Pack value directly to writable buffer starting from offset.
+        Returns number of bytes written.
+        """
+        self.struct.pack_into(buffer, offset, string)
+        return self.struct.size
+
 class Struct(BinStruct):
     def __init__(self, format):
         self._format = format
@@ -105,6 +134,13 @@ class Char(BinStruct):
                 string = bytearray(string, "utf-8")
         return self.struct.pack(string)
 
+    def pack_into(self, buffer, offset, string):
+        if python3:
+            if type(string) != bytes:
+                string = bytes(bytearray(string, "utf-8"))
+        self.struct.pack_into(buffer, offset, string)
+        return self.struct.size
+
 char = Char
 
 class Integer(BinStruct):
@@ -179,14 +215,35 @@ class String(BinStruct):
     """
     _type = str
 
-    def __init__(self, length_format='!I'):
+    def __init__(self, length_format='!I', max_length=None):
+        """
+        length_format: struct format of string length field
+        max_length: maximum string size in bytes, LimitExceeded is raised
+                    for longer strings
+        """
         self.length_format = length_format
         self.size_struct = SStruct(length_format)
+        self.max_length = max_length
 
     @property
     def size(self):
         raise SizeNotDefined()
 
+    def unpack_size(self, msg):
+        """
+        Read length field from start of msg.
+        Returns tuple of length field size and string size.
+        """
+        size = self.size_struct.unpack(msg[:self.size_struct.size])[0]
+        self._check_length(size)
+        self.custom_size = size
+        return (self.size_struct.size, size)
+
+    def _check_length(self, length):
+        if self.max_length is not None and length > self.max_length:
+            raise LimitExceeded("String is %d bytes, maximum is %d bytes" % (
+                                length, self.max_length))
+
     def unpack(self, msg):
         """
         Unpack string, little ugly but works
@@ -201,24 +258,330 @@ class String(BinStruct):
         #    #msg = x
         #    return msg.decode("utf-8")
         if python3:
-            return msg.decode("utf-8")
+            # str() decodes bytes and memoryviews alike without extra copy
+            return str(msg, "utf-8")
         s = [chr(unpack('!B', msg[i])[0]) for i in range(self.custom_size)]
         return ''.join(s)
 
-    def pack(self, msg):
+    def prepare(self, msg):
         """
-        Pack string with length
+        Encode string, already encoded strings are returned as is
         """
         if not python3:
             if type(msg) == unicode:
                 msg = msg.encode("utf-8")
-        else:
-            msg = bytearray(msg, 'utf-8')
+        elif not isinstance(msg, (bytes, bytearray)):
+            msg = msg.encode('utf-8')
+        self._check_length(len(msg))
+        return msg
+
+    def pack(self, msg):
+        """
+        Pack string with length
+        """
+        msg = self.prepare(msg)
         st = self.size_struct.pack(len(msg))
         return st + msg
         #st += b''.join([pack('!B', ord(msg[i])) for i in range(len(msg))])
         #return st
 
+    def packed_size(self, msg):
+        return self.size_struct.size + len(self.prepare(msg))
+
+    def pack_into(self, buffer, offset, msg):
+        """
+        Pack string with length directly to buffer
+        """
+        msg = self.prepare(msg)
+        self.size_struct.pack_into(buffer, offset, len(msg))
+        offset += self.size_struct.size
+        buffer[offset:offset + len(msg)] = msg
+        return self.size_struct.size + len(msg)
+
+
+class FixedString(BinStruct):
+    """
+    FixedString contains 0 to length bytes of encoded characters. Shorter
+    strings are padded with pad byte, so size is always length bytes.
+    Padding is stripped as bytes, so encoding should use one byte code units
+    (utf-8, latin-1, ascii...). Byte strings are packed as already encoded.
+    """
+    _type = None
+
+    def __init__(self, length, encoding='utf-8', pad=b'\0'):
+        if len(pad) != 1:
+            raise ValueError("Pad should be exactly one byte")
+        if len(u'A'.encode(encoding)) != 1:
+            raise ValueError("Encoding %s doesn't use one byte code units" %
+                             encoding)
+        self.length = length
+        self.encoding = encoding
+        self.pad = pad
+        self.struct = SStruct('!%ds' % length)
+        self._custom_size = None
+
+    def prepare(self, msg):
+        """
+        Encode and pad string, already padded byte strings are returned as is
+        """
+        if isinstance(msg, bytearray):
+            msg = bytes(msg)
+        elif not isinstance(msg, bytes):
+            if python3 and not isinstance(msg, str) or \
+                    not python3 and not isinstance(msg, unicode):
+                raise CannotPack("Value %r is not string" % (msg,))
+            msg = msg.encode(self.encoding)
+        if len(msg) == self.length:
+            return msg
+        if len(msg) > self.length:
+            raise CannotPack("String is %d bytes longer than maximum" % (
+                             len(msg) - self.length,))
+        return msg.ljust(self.length, self.pad)
+
+    def unpack(self, msg):
+        msg = self.struct.unpack(msg)[0].rstrip(self.pad)
+        if not python3:
+            # Like String, python2 strings are returned as byte strings
+            return (msg,)
+        return (msg.decode(self.encoding),)
+
+    def pack(self, msg):
+        return self.struct.pack(self.prepare(msg))
+
+    def pack_into(self, buffer, offset, msg):
+        self.struct.pack_into(buffer, offset, self.prepare(msg))
+        return self.struct.size
+
+fixedstring = FixedString
+
+class FixedBytes(BinStruct):
+    """
+    FixedBytes contains exactly length bytes, eg. UUID. If pad byte is given,
+    shorter values are padded on pack and stripped on unpack.
+    """
+    _type = None
+
+    def __init__(self, length, pad=None):
+        if pad is not None and len(pad) != 1:
+            raise ValueError("Pad should be exactly one byte")
+        self.length = length
+        self.pad = pad
+        self.struct = SStruct('!%ds' % length)
+        self._custom_size = None
+
+    def prepare(self, msg):
+        if not isinstance(msg, (bytes, bytearray)):
+            raise CannotPack("Value %r is not bytes" % (msg,))
+        if len(msg) > self.length:
+            raise CannotPack("Value is %d bytes longer than expected" % (
+                             len(msg) - self.length,))
+        if len(msg) < self.length:
+            if self.pad is None:
+                raise CannotPack("Value is %d bytes shorter than expected" % (
+                                 self.length - len(msg),))
+            msg = bytes(msg).ljust(self.length, self.pad)
+        return msg
+
+    def unpack(self, msg):
+        msg = self.struct.unpack(msg)[0]
+        if self.pad is not None:
+            msg = msg.rstrip(self.pad)
+        return (msg,)
+
+    def pack(self, msg):
+        return self.struct.pack(self.prepare(msg))
+
+    def pack_into(self, buffer, offset, msg):
+        self.struct.pack_into(buffer, offset, self.prepare(msg))
+        return self.struct.size
+
+fixedbytes = FixedBytes
+
+class StringDictionary(object):
+    """
+    Bounded dictionary of recently seen strings for one direction of stream.
+
+    Encoder and decoder keep their own copies which stay in sync as long as
+    every message is unpacked in same order it was packed. When dictionary
+    is full, least recently used string is evicted and its index reused.
+
+    Strings of one message are looked up from dictionary as it was before
+    the message. Changes are collected to pending and applied only after
+    whole message has been packed or unpacked, so failed message doesn't
+    change dictionary.
+    """
+    def __init__(self, size=256):
+        if size < 1:
+            raise ValueError("Dictionary size should be at least 1")
+        self.size = size
+        # index -> string, least recently used first
+        self._strings = OrderedDict()
+        # string -> index
+        self._indexes = {}
+        # (index, string) changes of current message, index is None for
+        # strings to add
+        self.pending = []
+        # Incremented whenever changes are applied
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._strings)
+
+    def lookup(self, string):
+        """
+        Return index of string or None if string is not in dictionary.
+        """
+        return self._indexes.get(string)
+
+    def get(self, index):
+        """
+        Return string with given index.
+        Raises CannotUnpack if index is unknown.
+        """
+        if index not in self._strings:
+            raise CannotUnpack("Unknown string dictionary index %d" % index)
+        return self._strings[index]
+
+    def use(self, index):
+        """
+        Mark string with given index recently used.
+        """
+        self._strings[index] = self._strings.pop(index)
+
+    def add(self, string):
+        """
+        Add string to dictionary, evicting least recently used string if
+        dictionary is full. Strings already in dictionary are marked
+        recently used.
+        Returns index of string.
+        """
+        if string in self._indexes:
+            index = self._indexes[string]
+            self.use(index)
+            return index
+        if len(self._strings) < self.size:
+            index = len(self._strings)
+        else:
+            (index, old) = self._strings.popitem(last=False)
+            del self._indexes[old]
+        self._strings[index] = string
+        self._indexes[string] = index
+        return index
+
+    def take_pending(self):
+        """
+        Return pending changes and start collecting changes of new message.
+        """
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    def apply(self, changes):
+        """
+        Apply changes returned by take_pending. Referenced strings are
+        marked used before adding new ones, so message doesn't evict strings
+        it refers to.
+        """
+        if changes:
+            self.generation += 1
+        for (index, string) in changes:
+            if index is not None:
+                self.use(index)
+        for (index, string) in changes:
+            if index is None:
+                self.add(string)
+
+class DictString(String):
+    """
+    String which is sent as reference to StringDictionary when same string
+    has been sent before.
+
+    Lowest bit of length field tells if rest of it is dictionary index (1)
+    or length of string following it (0).
+
+    Dictionary changes are only collected to its pending changes, BinMsg
+    applies them once whole message is packed or unpacked.
+    """
+
+    def __init__(self, dictionary, length_format='!I', max_length=None):
+        String.__init__(self, length_format, max_length)
+        self.dictionary = dictionary
+        self.max_header = 2 ** (8 * self.size_struct.size) - 1
+        if ((dictionary.size - 1) << 1) | 1 > self.max_header:
+            raise ValueError("Dictionary of %d strings doesn't fit to length "
+                             "field %s" % (dictionary.size, length_format))
+
+    def unpack_size(self, msg):
+        header = self.size_struct.unpack(msg[:self.size_struct.size])[0]
+        self.custom_size = header
+        if header & 1:
+            return (self.size_struct.size, 0)
+        self._check_length(header >> 1)
+        return (self.size_struct.size, header >> 1)
+
+    def unpack(self, msg):
+        header = self.custom_size
+        if header & 1:
+            string = self.dictionary.get(header >> 1)
+            self.dictionary.pending.append((header >> 1, string))
+            return (string,)
+        if len(msg) != header >> 1:
+            raise CannotUnpack("Got message with wrong length!")
+        if python3:
+            string = intern(str(msg, "utf-8"))
+        else:
+            # Like String, python2 strings are returned as byte strings
+            string = intern(str(msg))
+        self.dictionary.pending.append((None, string))
+        return (string,)
+
+    def prepare(self, msg):
+        """
+        Returns tuple of length field value, encoded string, which is None
+        for strings found from dictionary, and string itself. Tuples are
+        returned as is.
+        """
+        if isinstance(msg, tuple):
+            return msg
+        index = self.dictionary.lookup(msg)
+        if index is not None:
+            self.dictionary.pending.append((index, msg))
+            return ((index << 1) | 1, None, msg)
+        if not python3:
+            data = msg
+            if type(msg) == unicode:
+                data = msg.encode("utf-8")
+        else:
+            data = msg.encode('utf-8')
+        self._check_length(len(data))
+        if len(data) << 1 > self.max_header:
+            raise CannotPack("String of %d bytes doesn't fit to length field" %
+                             len(data))
+        self.dictionary.pending.append((None, msg))
+        return (len(data) << 1, data, msg)
+
+    def pack(self, msg):
+        (header, data, msg) = self.prepare(msg)
+        output = self.size_struct.pack(header)
+        if data is not None:
+            output += data
+        return output
+
+    def packed_size(self, msg):
+        (header, data, msg) = self.prepare(msg)
+        if data is None:
+            return self.size_struct.size
+        return self.size_struct.size + len(data)
+
+    def pack_into(self, buffer, offset, msg):
+        (header, data, msg) = self.prepare(msg)
+        self.size_struct.pack_into(buffer, offset, header)
+        size = self.size_struct.size
+        if data is not None:
+            buffer[offset + size:offset + size + len(data)] = data
+            size += len(data)
+        return size
+
 
 
 class Condition(object):
@@ -321,8 +684,141 @@ class ValueIs(Condition):
 string = String
 
 
+class LengthStruct(object):
+    """
+    Message length field packed with struct format, eg. '!H'.
+    """
+    def __init__(self, format):
+        code = format[1:] if format[:1] in '@=<>!' else format
+        if code not in ('B', 'H', 'I', 'L', 'Q'):
+            raise ValueError("Length field format %r should be unsigned "
+                             "integer" % (format,))
+        self.format = format
+        self.struct = SStruct(format)
+        self.max = 2 ** (8 * self.struct.size) - 1
+
+    def size(self, length):
+        """
+        Return size of length field for given length
+        """
+        return self.struct.size
+
+    def pack(self, length):
+        return self.struct.pack(length)
+
+    def pack_into(self, buffer, offset, length):
+        self.struct.pack_into(buffer, offset, length)
+
+    def unpack_from(self, msg):
+        """
+        Unpack length from start of msg.
+        Returns tuple of length field size and length, None if msg is too
+        short to contain length field.
+        """
+        if len(msg) < self.struct.size:
+            return None
+        return (self.struct.size, self.struct.unpack(msg[:self.struct.size])[0])
+
+class LengthVarInt(object):
+    """
+    Message length field as unsigned LEB128 varint, 7 bits per byte.
+    """
+    max = 2 ** 64 - 1
+    max_size = 10
+
+    def size(self, length):
+        size = 1
+        while length > 0x7f:
+            length >>= 7
+            size += 1
+        return size
+
+    def pack(self, length):
+        output = bytearray(self.size(length))
+        self.pack_into(output, 0, length)
+        return bytes(output)
+
+    def pack_into(self, buffer, offset, length):
+        while length > 0x7f:
+            buffer[offset] = (length & 0x7f) | 0x80
+            length >>= 7
+            offset += 1
+        buffer[offset] = length
+
+    def unpack_from(self, msg):
+        length = 0
+        for i in range(min(len(msg), self.max_size)):
+            byte = msg[i]
+            if not python3:
+                byte = ord(byte)
+            length |= (byte & 0x7f) << (7 * i)
+            if not byte & 0x80:
+                return (i + 1, length)
+        if len(msg) >= self.max_size:
+            raise CannotUnpack("Length field is longer than %d bytes" %
+                               self.max_size)
+        return None
+
+class NoLength(object):
+    """
+    No length field, messages are framed by transport.
+    """
+    max = None
+
+    def size(self, length):
+        return 0
+
+    def pack(self, length):
+        return b''
+
+    def pack_into(self, buffer, offset, length):
+        pass
+
+    def unpack_from(self, msg):
+        return (0, len(msg))
+
+def get_length_field(format):
+    """
+    Return length field for format: struct format string such as '!B',
+    '!H', '!I' or '!Q', 'varint', or None for no length field.
+    """
+    if format is None:
+        return NoLength()
+    if format == 'varint':
+        return LengthVarInt()
+    if isinstance(format, (LengthStruct, LengthVarInt, NoLength)):
+        return format
+    return LengthStruct(format)
+
+
+class PreparedMessage(object):
+    """
+    Message validated and encoded by BinMsg.prepare.
+
+    fields: list of (struct, prepared value) tuples
+    body_size: size of message without length field
+    size: size of message with length field
+    changes: string dictionary changes applied once message is packed
+    generation: string dictionary generation changes are based on
+    """
+    def __init__(self, fields, body_size, size, changes=None, generation=None):
+        self.fields = fields
+        self.body_size = body_size
+        self.size = size
+        self.changes = changes
+        self.generation = generation
+
+
 class BinMsg(object):
-    def __init__(self, definitions):
+    def __init__(self, definitions, size_format='!I', max_frame_size=None):
+        """
+        definitions: list of field definitions
+        size_format: format of message length field, struct format such as
+                     '!B', '!H', '!I' or '!Q', 'varint', or None when
+                     messages are framed by transport
+        max_frame_size: maximum message size without length field,
+                        LimitExceeded is raised for longer messages
+        """
         self.definitions = []
         for v in definitions:
             if 'name' not in v:
@@ -330,35 +826,107 @@ class BinMsg(object):
             if 'struct' not in v:
                 raise ValueError("Struct is mandatory argument!")
             self.definitions.append(v)
-        self.size_format = SStruct('!I')
+        self.length_field = get_length_field(size_format)
+        # struct.Struct of length field, None for varint and no length field
+        self.size_format = None
+        self._pack_length = self.length_field.pack
+        if isinstance(self.length_field, LengthStruct):
+            self.size_format = self.length_field.struct
+            self._pack_length = self.size_format.pack
+        self.max_frame_size = max_frame_size
+        # Longest message pack accepts without checking limits in detail
+        self._max_pack_length = min([l for l in [self.length_field.max,
+                                                 max_frame_size]
+                                     if l is not None] or [float('inf')])
+        # StringDictionary used by DictString fields, see StringDictEncoder
+        self.string_dictionary = None
+        self._layout = self._fixed_layout()
+        # Size of message body without length field, None if not fixed
+        self.fixed_size = None
+        if self._layout is not None:
+            self.fixed_size = sum([size for (_, _, _, size) in self._layout])
+
+    def _fixed_layout(self):
+        """
+        Precompute (name, struct, offset, size) for every field if all fields
+        are unconditional and fixed size, otherwise return None.
+        """
+        layout = []
+        offset = 0
+        names = set()
+        for definition in self.definitions:
+            if 'condition' in definition or definition['name'] in names:
+                return None
+            try:
+                size = definition['struct'].size
+            except SizeNotDefined:
+                return None
+            names.add(definition['name'])
+            layout.append((definition['name'], definition['struct'], offset, size))
+            offset += size
+        return layout
+
 
     @property
     def size_length(self):
-        return self.size_format.size
+        """
+        Size of length field, None if it depends on length (varint)
+        """
+        if isinstance(self.length_field, LengthVarInt):
+            return None
+        return self.length_field.size(0)
+
+    def _check_length(self, length):
+        """
+        Raises LimitExceeded if message length is over max_frame_size.
+        """
+        if self.max_frame_size is not None and length > self.max_frame_size:
+            raise LimitExceeded("Message is %d bytes, maximum is %d bytes" % (
+                                length, self.max_frame_size))
+
+    def frame_length(self, msg):
+        """
+        Read length field from start of msg, which may contain only part of
+        message. Useful for stream readers to know how much to read before
+        buffering rest of message.
+        Raises LimitExceeded if length is over max_frame_size.
+        Returns tuple of length field size and message length, None if msg
+        is too short to contain length field.
+        """
+        if isinstance(self.length_field, NoLength):
+            raise CannotUnpack("Messages don't have length field")
+        length = self.length_field.unpack_from(msg)
+        if length is None:
+            return None
+        self._check_length(length[1])
+        return (length[0], int(length[1]))
 
     def unpack_length(self, msg):
         """
         Unpack given length message and return length value.
-        Raises CannotUnpack if given msg length is not correct.
+        Raises CannotUnpack if given msg length is not correct and
+        LimitExceeded if length is over max_frame_size.
         """
-        if len(msg) < self.size_length:
+        length = self.frame_length(msg)
+        if length is None:
             raise CannotUnpack("Length message is too short")
-        elif len(msg) > self.size_length:
+        elif len(msg) > length[0]:
             raise CannotUnpack("Length message is too long")
-        return int(self.size_format.unpack(msg)[0])
+        return length[1]
 
     def pack_length(self, length):
         """
         Pack length integer
         """
-        return self.size_format.pack(length)
+        return self.length_field.pack(length)
 
 
-    def pack(self, msg):
+    def _fields(self, msg, pack=False):
         """
-        Pack given message (dict) to binary message using predefined fields.
-        If pack fails, CannotPack is raised.
-        Returns binary string.
+        Validate given message (dict) against predefined fields.
+        If validation fails, CannotPack is raised.
+        Returns list of (struct, value) tuples in packing order, or list of
+        packed values if pack is True.
         """
         if type(msg) != dict:
             raise ValueError("Msg should be dict!")
@@ -395,9 +963,112 @@ class BinMsg(object):
                     raise CannotPack(
                          "Value %s for field %s is too big, maximum is %s" % (
                                      value, definition['name'], struct._max))
-            output.append(struct.pack(value))
+            if pack:
+                output.append(struct.pack(value))
+            else:
+                output.append((struct, value))
+        return output
+
+    def _check_pack_length(self, length):
+        """
+        Raises CannotPack if length doesn't fit to length field and
+        LimitExceeded if it's over max_frame_size.
+        """
+        if self.length_field.max is not None and length > self.length_field.max:
+            raise CannotPack("Message of %d bytes doesn't fit to length field" %
+                             length)
+        self._check_length(length)
+
+    def prepare(self, msg):
+        """
+        Validate given message (dict) and encode its values once, so its
+        size can be checked before packing it with pack_prepared_into.
+        If validation fails, CannotPack is raised.
+        Returns PreparedMessage.
+        """
+        if self.string_dictionary is not None:
+            self.string_dictionary.take_pending()
+        fields = [(struct, struct.prepare(value))
+                  for (struct, value) in self._fields(msg)]
+        body_size = sum([struct.packed_size(value) for (struct, value) in fields])
+        self._check_pack_length(body_size)
+        changes = None
+        generation = None
+        if self.string_dictionary is not None:
+            changes = self.string_dictionary.take_pending()
+            generation = self.string_dictionary.generation
+        return PreparedMessage(fields, body_size,
+                               self.length_field.size(body_size) + body_size,
+                               changes, generation)
+
+    def _packed(self, prepared):
+        """
+        Apply string dictionary changes after message has been packed.
+        """
+        if prepared.changes:
+            self.string_dictionary.apply(prepared.changes)
+
+    def pack_prepared_into(self, buffer, offset, prepared):
+        """
+        Pack PreparedMessage directly to writable buffer starting from offset.
+        If message doesn't fit to buffer or string dictionary has changed
+        since message was prepared, CannotPack is raised.
+        Returns number of bytes written.
+        """
+        if self.string_dictionary is not None and \
+                prepared.generation != self.string_dictionary.generation:
+            raise CannotPack("String dictionary has changed since message "
+                             "was prepared")
+        if offset < 0 or len(buffer) - offset < prepared.size:
+            raise CannotPack("Message of %d bytes doesn't fit to buffer" %
+                             prepared.size)
+        width = self.length_field.size(prepared.body_size)
+        start = offset
+        offset += width
+        try:
+            for (struct, value) in prepared.fields:
+                offset += struct.pack_into(buffer, offset, value)
+        except StructError as e:
+            raise CannotPack(str(e))
+        self.length_field.pack_into(buffer, start, offset - start - width)
+        self._packed(prepared)
+        return offset - start
+
+    def pack(self, msg):
+        """
+        Pack given message (dict) to binary message using predefined fields.
+        If pack fails, CannotPack is raised.
+        Returns binary string.
+        """
+        if self.string_dictionary is not None:
+            self.string_dictionary.take_pending()
+        try:
+            output = self._fields(msg, pack=True)
+        except StructError as e:
+            raise CannotPack(str(e))
         output = b''.join(output)
-        return self.size_format.pack(len(output)) + output
+        if len(output) > self._max_pack_length:
+            self._check_pack_length(len(output))
+        output = self._pack_length(len(output)) + output
+        if self.string_dictionary is not None:
+            self.string_dictionary.apply(self.string_dictionary.take_pending())
+        return output
+
+    def packed_size(self, msg):
+        """
+        Return number of bytes pack would produce for given message.
+        """
+        return self.prepare(msg).size
+
+    def pack_into(self, buffer, offset, msg):
+        """
+        Pack given message (dict) directly to writable buffer (bytearray,
+        memoryview, mmap...) starting from offset, without building
+        intermediate binary string.
+        If pack fails or message doesn't fit to buffer, CannotPack is raised.
+        Returns number of bytes written.
+        """
+        return self.pack_prepared_into(buffer, offset, self.prepare(msg))
 
     def unpack(self, msg):
         """
@@ -406,14 +1077,23 @@ class BinMsg(object):
         Returns message dictionary.
         """
         output = {}
-        if len(msg) < self.size_format.size:
-            raise CannotUnpack("Message size is shorter than length field")
-        l = self.unpack_length(msg[:self.size_length])
-        msg = msg[self.size_length:]
+        if self.string_dictionary is not None:
+            self.string_dictionary.take_pending()
+        if isinstance(self.length_field, NoLength):
+            self._check_length(len(msg))
+            l = len(msg)
+        else:
+            length = self.frame_length(msg)
+            if length is None:
+                raise CannotUnpack("Message size is shorter than length field")
+            (size_length, l) = length
+            msg = msg[size_length:]
         if len(msg) < l:
             raise CannotUnpack("Message is %d bytes shorter than expected" % (l - len(msg),))
         elif len(msg) > l:
             raise CannotUnpack("Message is %d bytes longer than expected" % (len(msg) - l,))
+        if self._layout is not None:
+            return self._unpack_fixed(msg)
         for definition in self.definitions:
             if definition['name'] in output:
                 continue
@@ -425,14 +1105,20 @@ class BinMsg(object):
                 size = struct.size
             except SizeNotDefined:
                 try:
-                    size_msg = msg[:struct.size_struct.size]
-                    msg = msg[struct.size_struct.size:]
-                    size = struct.size_struct.unpack(size_msg)[0]
-                    struct.custom_size = size
+                    (header, size) = struct.unpack_size(msg)
+                except LimitExceeded:
+                    raise
                 except Exception as e:
                     logger.exception(e)
-            if not size:
-                raise CannotUnpack("Cannot get size of element %s" %
+                    raise CannotUnpack("Cannot get size of element %s" %
+                                                            definition['name'])
+                msg = msg[header:]
+                if size > len(msg):
+                    raise CannotUnpack("Element %s is %d bytes longer than message" % (
+                                       definition['name'], size - len(msg)))
+            else:
+                if not size:
+                    raise CannotUnpack("Cannot get size of element %s" %
                                                             definition['name'])
             m = msg[:size]
             msg = msg[size:]
@@ -441,5 +1127,88 @@ class BinMsg(object):
                 # unpack returns tuples
                 value = value[0]
             output[definition['name']] = value
+        if self.string_dictionary is not None:
+            self.string_dictionary.apply(self.string_dictionary.take_pending())
+        return output
+
+    def _unpack_fixed(self, msg):
+        """
+        Unpack message body using precomputed field offsets.
+        """
+        if len(msg) != self.fixed_size:
+            raise CannotUnpack("Message is %d bytes, expected %d bytes" % (
+                               len(msg), self.fixed_size))
+        output = {}
+        for (name, struct, offset, size) in self._layout:
+            value = struct.unpack(msg[offset:offset + size])
+            if len(value) == 1:
+                # unpack returns tuples
+                value = value[0]
+            output[name] = value
         return output
 
+
+def _dictionary_binmsg(binmsg, dictionary):
+    """
+    Returns copy of binmsg where String fields use given dictionary.
+    """
+    definitions = []
+    for definition in binmsg.definitions:
+        struct = definition['struct']
+        if isinstance(struct, String):
+            definition = dict(definition)
+            definition['struct'] = DictString(dictionary, struct.length_format,
+                                              struct.max_length)
+        definitions.append(definition)
+    output = BinMsg(definitions, binmsg.length_field, binmsg.max_frame_size)
+    output.string_dictionary = dictionary
+    return output
+
+
+class StringDictEncoder(object):
+    """
+    Packs messages of one stream (connection, file) replacing repeated
+    String values with references to recently sent strings.
+
+    Messages must be unpacked with StringDictDecoder of same size in same
+    order they were packed.
+    """
+    def __init__(self, binmsg, size=256):
+        """
+        binmsg: BinMsg used to pack messages
+        size: maximum number of strings remembered
+        """
+        self.dictionary = StringDictionary(size)
+        self.binmsg = _dictionary_binmsg(binmsg, self.dictionary)
+
+    def pack(self, msg):
+        return self.binmsg.pack(msg)
+
+    def packed_size(self, msg):
+        return self.binmsg.packed_size(msg)
+
+    def pack_into(self, buffer, offset, msg):
+        return self.binmsg.pack_into(buffer, offset, msg)
+
+    def prepare(self, msg):
+        return self.binmsg.prepare(msg)
+
+    def pack_prepared_into(self, buffer, offset, prepared):
+        return self.binmsg.pack_prepared_into(buffer, offset, prepared)
+
+
+class StringDictDecoder(object):
+    """
+    Unpacks messages packed with StringDictEncoder. Repeated strings are
+    returned as same interned str objects.
+    """
+    def __init__(self, binmsg, size=256):
+        """
+        binmsg: BinMsg used to unpack messages
+        size: maximum number of strings remembered, same as encoder's
+        """
+        self.dictionary = StringDictionary(size)
+        self.binmsg = _dictionary_binmsg(binmsg, self.dictionary)
+
+    def unpack(self, msg):
+        return self.binmsg.unpack(msg)
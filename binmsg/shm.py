@@ -0,0 +1,220 @@
+# encoding: utf-8
+"""
+Shared memory ring buffer for passing BinMsg messages between processes
+on same host.
+
+Ring is single producer, single consumer. Producer packs messages directly
+to shared memory and consumer unpacks them directly from it, so messages
+are never copied to intermediate binary strings. No locks are used,
+producer only moves head and consumer only moves tail.
+
+Example::
+
+    >>> from binmsg.shm import RingBuffer
+    >>> producer = RingBuffer(b, create=True, capacity=65536)
+    >>> consumer = RingBuffer(b, name=producer.name)
+    >>> producer.write({'type': 1, 'name': 'Test', 'age': 20})
+    >>> consumer.read()
+    {'type': 1, 'name': 'Test', 'age': 20}
+
+Requires python >= 3.8.
+"""
+
+from struct import Struct as SStruct
+from multiprocessing import shared_memory, resource_tracker
+import sys
+import time
+
+from binmsg.binmsg import BinMsgException, CannotPack
+
+
+class RingFull(BinMsgException):
+    pass
+
+class RingEmpty(BinMsgException):
+    pass
+
+
+# head and tail counters live on separate cache lines
+_COUNTER = SStruct('=Q')
+_HEAD_OFFSET = 0
+_TAIL_OFFSET = 64
+_CAPACITY_OFFSET = 128
+_DATA_OFFSET = 192
+
+# Every record is prefixed with its length, WRAP tells consumer to continue
+# from start of ring. Record header not fitting to end of ring means the same.
+_RECORD = SStruct('=I')
+_WRAP = 0xFFFFFFFF
+
+
+class RingBuffer(object):
+    """
+    Single producer, single consumer ring buffer on
+    multiprocessing.shared_memory.
+    """
+
+    def __init__(self, binmsg, name=None, create=False, capacity=0,
+                 poll_interval=0.0001):
+        """
+        binmsg: BinMsg used to pack and unpack messages
+        name: name of shared memory block, required when attaching
+        create: create new shared memory block instead of attaching
+        capacity: size of data area in bytes when creating
+        poll_interval: seconds to sleep between checks when blocking
+        """
+        self.binmsg = binmsg
+        self.poll_interval = poll_interval
+        if create:
+            if capacity <= _RECORD.size:
+                raise ValueError("Capacity should be more than %d bytes" %
+                                 _RECORD.size)
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=_DATA_OFFSET + capacity)
+            self.buf = self.shm.buf
+            _COUNTER.pack_into(self.buf, _HEAD_OFFSET, 0)
+            _COUNTER.pack_into(self.buf, _TAIL_OFFSET, 0)
+            _COUNTER.pack_into(self.buf, _CAPACITY_OFFSET, capacity)
+        else:
+            if name is None:
+                raise ValueError("Name is mandatory when attaching!")
+            self.shm = self._attach(name)
+            self.buf = self.shm.buf
+        self.capacity = _COUNTER.unpack_from(self.buf, _CAPACITY_OFFSET)[0]
+        self.data = self.buf[_DATA_OFFSET:_DATA_OFFSET + self.capacity]
+
+    def _attach(self, name):
+        """
+        Attach to existing shared memory without tracking it. Tracked
+        shared memory is unlinked when attaching process exits, even if
+        creating process still uses it.
+        """
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        # Unregistering afterwards isn't enough: processes started by
+        # multiprocessing share the tracker with creating process, which
+        # would then lose its own registration. Skip registering instead.
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _head(self):
+        return _COUNTER.unpack_from(self.buf, _HEAD_OFFSET)[0]
+
+    def _tail(self):
+        return _COUNTER.unpack_from(self.buf, _TAIL_OFFSET)[0]
+
+    def __len__(self):
+        """
+        Number of bytes used by unread records
+        """
+        return self._head() - self._tail()
+
+    def empty(self):
+        return self._head() == self._tail()
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            return None
+        return time.time() + timeout
+
+    def _wait(self, ready, block, deadline, exception):
+        """
+        Poll until ready() returns True.
+        Raises exception if not blocking or deadline passes.
+        """
+        if ready():
+            return
+        if not block:
+            raise exception()
+        while not ready():
+            if deadline is not None and time.time() >= deadline:
+                raise exception()
+            time.sleep(self.poll_interval)
+
+    def write(self, msg, block=True, timeout=None):
+        """
+        Pack message directly to ring.
+        If ring is full and block is False or timeout expires, RingFull is
+        raised. If message can never fit to ring, CannotPack is raised.
+        """
+        prepared = self.binmsg.prepare(msg)
+        needed = _RECORD.size + prepared.size
+        if needed > self.capacity:
+            raise CannotPack("Message of %d bytes doesn't fit to ring of %d bytes" % (
+                             prepared.size, self.capacity))
+        deadline = self._deadline(timeout)
+        head = self._head()
+        position = head % self.capacity
+        if self.capacity - position < needed:
+            # Message doesn't fit to end of ring, continue from start. Wrap is
+            # published alone so consumer can release end of ring before
+            # there is room for message at start.
+            skip = self.capacity - position
+            self._wait(lambda: self.capacity - (head - self._tail()) >= skip,
+                       block, deadline, RingFull)
+            if skip >= _RECORD.size:
+                _RECORD.pack_into(self.data, position, _WRAP)
+            head += skip
+            _COUNTER.pack_into(self.buf, _HEAD_OFFSET, head)
+            position = 0
+        self._wait(lambda: self.capacity - (head - self._tail()) >= needed,
+                   block, deadline, RingFull)
+        size = self.binmsg.pack_prepared_into(self.data,
+                                              position + _RECORD.size, prepared)
+        _RECORD.pack_into(self.data, position, size)
+        # Publish record only after it has been written completely
+        _COUNTER.pack_into(self.buf, _HEAD_OFFSET, head + _RECORD.size + size)
+
+    def read(self, block=True, timeout=None):
+        """
+        Unpack next message directly from ring.
+        If ring is empty and block is False or timeout expires, RingEmpty is
+        raised.
+        Returns message dictionary.
+        """
+        deadline = self._deadline(timeout)
+        tail = self._tail()
+        self._wait(lambda: self._head() != tail, block, deadline, RingEmpty)
+        position = tail % self.capacity
+        if self.capacity - position < _RECORD.size or \
+                _RECORD.unpack_from(self.data, position)[0] == _WRAP:
+            # Producer continued from start of ring, release end of ring
+            # and wait for message there
+            tail += self.capacity - position
+            _COUNTER.pack_into(self.buf, _TAIL_OFFSET, tail)
+            self._wait(lambda: self._head() != tail, block, deadline, RingEmpty)
+            position = 0
+        size = _RECORD.unpack_from(self.data, position)[0]
+        start = position + _RECORD.size
+        try:
+            output = self.binmsg.unpack(self.data[start:start + size])
+        finally:
+            # Release space even for broken messages
+            _COUNTER.pack_into(self.buf, _TAIL_OFFSET, tail + _RECORD.size + size)
+        return output
+
+    def close(self):
+        """
+        Detach from shared memory. Call unlink to also free it.
+        """
+        self.data.release()
+        self.data = None
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -6,6 +6,17 @@ import binmsg
 import unittest
 import struct
 import logging
+import threading
+import subprocess
+import sys
+import os
+import time
+
+try:
+    from binmsg import shm
+except ImportError:
+    # multiprocessing.shared_memory requires python >= 3.8
+    shm = None
 
 
 logger = logging.getLogger()
@@ -154,6 +165,91 @@ class TestTypes(unittest.TestCase):
         out = b.unpack(out)
         self.assertEqual(out['string'], '☃☃☃☃☃☃', "Wrong value for string %s" % (out['string'],))
 
+    def test_fixedstring(self):
+        defs = [{'name': 'symbol', 'struct': binmsg.FixedString(8)},
+                {'name': 'price', 'struct': binmsg.uint()},]
+        b = binmsg.BinMsg(definitions=defs)
+        self.assertEqual(b.fixed_size, 12)
+        out = b.pack({'symbol': 'ABC', 'price': 5})
+        self.assertEqual(struct.pack('!I8sI', 12, b'ABC', 5), out,
+                                                "Wrong value for packed string")
+        out = b.unpack(out)
+        self.assertEqual(out['symbol'], 'ABC', "Wrong value for string")
+        self.assertEqual(out['price'], 5, "Wrong value for number")
+        out = b.unpack(b.pack({'symbol': '☃☃', 'price': 5}))
+        self.assertEqual(out['symbol'], '☃☃', "Wrong value for string")
+        try:
+            b.pack({'symbol': 'ABCDEFGHI', 'price': 5})
+        except binmsg.CannotPack:
+            pass
+        else:
+            self.fail("Too long string should raise CannotPack error")
+
+    def test_fixedstring_bytes(self):
+        defs = [{'name': 'symbol', 'struct': binmsg.FixedString(8)},]
+        b = binmsg.BinMsg(definitions=defs)
+        out = b.pack({'symbol': b'ab'})
+        self.assertEqual(struct.pack('!I8s', 8, b'ab'), out,
+                                                "Wrong value for packed string")
+        self.assertEqual(b.unpack(out)['symbol'], 'ab')
+        defs = [{'name': 'symbol', 'struct': binmsg.FixedString(4)},]
+        b = binmsg.BinMsg(definitions=defs)
+        self.assertEqual(struct.pack('!I4s', 4, b'abcd'),
+                         b.pack({'symbol': b'abcd'}))
+        for value in [b'abcde', 1234]:
+            with self.assertRaises(binmsg.CannotPack):
+                b.pack({'symbol': value})
+
+    def test_fixedstring_pad(self):
+        defs = [{'name': 'country', 'struct': binmsg.FixedString(3, 'ascii', pad=b' ')},]
+        b = binmsg.BinMsg(definitions=defs)
+        out = b.pack({'country': 'FI'})
+        self.assertEqual(struct.pack('!I3s', 3, b'FI '), out,
+                                                "Wrong value for packed string")
+        self.assertEqual(b.unpack(out)['country'], 'FI', "Wrong value for string")
+
+    def test_fixedstring_encoding(self):
+        defs = [{'name': 'name', 'struct': binmsg.FixedString(8, 'latin-1')},]
+        b = binmsg.BinMsg(definitions=defs)
+        value = u'\xe4\xe4'
+        if not binmsg.binmsg.python3:
+            # python2 strings are already encoded
+            value = b'\xe4\xe4'
+        out = b.pack({'name': value})
+        self.assertEqual(struct.pack('!I8s', 8, b'\xe4\xe4'), out,
+                                                "Wrong value for packed string")
+        self.assertEqual(b.unpack(out)['name'], value)
+        for encoding in ['utf-16-le', 'utf-16', 'utf-32']:
+            try:
+                binmsg.FixedString(8, encoding)
+            except ValueError:
+                pass
+            else:
+                self.fail("Encoding %s should raise ValueError" % encoding)
+
+    def test_fixedbytes(self):
+        defs = [{'name': 'uuid', 'struct': binmsg.FixedBytes(16)},]
+        b = binmsg.BinMsg(definitions=defs)
+        value = b'\x01' * 15 + b'\0'
+        out = b.pack({'uuid': value})
+        self.assertEqual(struct.pack('!I16s', 16, value), out,
+                                                 "Wrong value for packed bytes")
+        self.assertEqual(b.unpack(out)['uuid'], value, "Wrong value for bytes")
+        for invalid in [b'\x01' * 15, b'\x01' * 17, u'x' * 16]:
+            try:
+                b.pack({'uuid': invalid})
+            except binmsg.CannotPack:
+                pass
+            else:
+                self.fail("Invalid value %r should raise CannotPack error" % (
+                                                                     invalid,))
+        defs = [{'name': 'data', 'struct': binmsg.FixedBytes(4, pad=b'\0')},]
+        b = binmsg.BinMsg(definitions=defs)
+        out = b.pack({'data': b'ab'})
+        self.assertEqual(struct.pack('!I4s', 4, b'ab'), out,
+                                                 "Wrong value for packed bytes")
+        self.assertEqual(b.unpack(out)['data'], b'ab', "Wrong value for bytes")
+
     def test_biginteger(self):
         defs = [{'name': 'number', 'struct': binmsg.BigInteger()},]
         b = binmsg.BinMsg(definitions=defs)
@@ -213,6 +309,412 @@ class TestTypes(unittest.TestCase):
             self.fail("Invalid type should raise CannotPack error")
 
 
+class TestPackInto(unittest.TestCase):
+    def setUp(self):
+        defs = [
+            {'name': 'type', 'struct': binmsg.uchar()},
+            {'name': 'name', 'struct': binmsg.string()},
+            {'name': 'char', 'struct': binmsg.char()},
+            {'name': 'age', 'struct': binmsg.uint()},
+        ]
+        self.binmsg = binmsg.BinMsg(definitions=defs)
+        self.msg = {'type': 1, 'name': 'Test ☃', 'char': b'z', 'age': 20}
+
+    def test_pack_into(self):
+        packed = self.binmsg.pack(self.msg)
+        self.assertEqual(self.binmsg.packed_size(self.msg), len(packed))
+        buf = bytearray(len(packed) + 3)
+        n = self.binmsg.pack_into(buf, 3, self.msg)
+        self.assertEqual(n, len(packed))
+        self.assertEqual(bytes(buf[3:]), packed)
+        out = self.binmsg.unpack(memoryview(buf)[3:])
+        self.assertEqual(out, {'type': 1, 'name': 'Test ☃', 'char': 'z', 'age': 20})
+
+    def test_prepare(self):
+        prepared = self.binmsg.prepare(self.msg)
+        packed = self.binmsg.pack(self.msg)
+        self.assertEqual(prepared.size, len(packed))
+        self.assertEqual(prepared.body_size, len(packed) - 4)
+        buf = bytearray(prepared.size)
+        self.assertEqual(self.binmsg.pack_prepared_into(buf, 0, prepared),
+                         len(packed))
+        self.assertEqual(bytes(buf), packed)
+        with self.assertRaises(binmsg.CannotPack):
+            self.binmsg.pack_prepared_into(buf, 1, prepared)
+
+    def test_pack_into_too_small(self):
+        buf = bytearray(self.binmsg.packed_size(self.msg) - 1)
+        with self.assertRaises(binmsg.CannotPack):
+            self.binmsg.pack_into(buf, 0, self.msg)
+
+
+@unittest.skipIf(shm is None, "shared memory is not supported")
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.shm = shm
+        defs = [
+            {'name': 'type', 'struct': binmsg.uchar()},
+            {'name': 'name', 'struct': binmsg.string()},
+        ]
+        self.binmsg = binmsg.BinMsg(definitions=defs)
+        self.producer = shm.RingBuffer(self.binmsg, create=True, capacity=64)
+        self.consumer = shm.RingBuffer(self.binmsg, name=self.producer.name)
+
+    def tearDown(self):
+        self.consumer.close()
+        self.producer.close()
+        self.producer.unlink()
+
+    def test_write_read(self):
+        self.producer.write({'type': 1, 'name': 'Test'})
+        self.producer.write({'type': 2, 'name': '☃'})
+        self.assertEqual(self.consumer.read(), {'type': 1, 'name': 'Test'})
+        self.assertEqual(self.consumer.read(), {'type': 2, 'name': '☃'})
+        self.assertTrue(self.consumer.empty())
+
+    def test_wraparound(self):
+        # Records are 4 + 4 + 1 + 4 + 7 = 20 bytes, do not divide 64 evenly
+        for i in range(20):
+            msg = {'type': i, 'name': 'msg %03d' % i}
+            self.producer.write(msg, block=False)
+            self.assertEqual(self.consumer.read(block=False), msg)
+
+    def test_nonblocking(self):
+        with self.assertRaises(self.shm.RingEmpty):
+            self.consumer.read(block=False)
+        self.producer.write({'type': 1, 'name': 'a' * 10})
+        self.producer.write({'type': 1, 'name': 'a' * 10})
+        with self.assertRaises(self.shm.RingFull):
+            self.producer.write({'type': 1, 'name': 'a' * 10}, block=False)
+        with self.assertRaises(self.shm.RingFull):
+            self.producer.write({'type': 1, 'name': 'a' * 10}, timeout=0.01)
+        self.consumer.read()
+        self.producer.write({'type': 1, 'name': 'a' * 10}, block=False)
+
+    def test_separate_process(self):
+        # Consumer in its own interpreter must not unlink ring on exit
+        script = (
+            "import binmsg\n"
+            "from binmsg.shm import RingBuffer\n"
+            "defs = [{'name': 'type', 'struct': binmsg.uchar()},\n"
+            "        {'name': 'name', 'struct': binmsg.string()}]\n"
+            "ring = RingBuffer(binmsg.BinMsg(definitions=defs), name=%r)\n"
+            "for i in range(100):\n"
+            "    assert ring.read(timeout=5) == {'type': i, 'name': 'msg %%d' %% i}\n"
+            "ring.close()\n" % (self.producer.name,))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+                                            os.path.abspath(binmsg.__file__)))
+        consumer = subprocess.Popen([sys.executable, '-c', script], env=env,
+                                    stderr=subprocess.PIPE)
+        for i in range(100):
+            self.producer.write({'type': i, 'name': 'msg %d' % i}, timeout=5)
+        stderr = consumer.communicate(timeout=10)[1]
+        self.assertEqual(consumer.returncode, 0, stderr)
+        self.assertNotIn(b'leaked', stderr)
+        # Ring still exists and works after consumer exited
+        time.sleep(0.2)
+        ring = self.shm.RingBuffer(self.binmsg, name=self.producer.name)
+        self.producer.write({'type': 1, 'name': 'after'})
+        self.assertEqual(ring.read(timeout=1), {'type': 1, 'name': 'after'})
+        ring.close()
+
+    def test_attach_untracked(self):
+        # Children started by multiprocessing share resource tracker with
+        # parent, attaching must leave creator's registration alone
+        from multiprocessing import resource_tracker
+        calls = []
+        register = resource_tracker.register
+        unregister = resource_tracker.unregister
+        resource_tracker.register = lambda *args: calls.append(args)
+        resource_tracker.unregister = lambda *args: calls.append(args)
+        try:
+            ring = self.shm.RingBuffer(self.binmsg, name=self.producer.name)
+        finally:
+            resource_tracker.register = register
+            resource_tracker.unregister = unregister
+        ring.close()
+        self.assertEqual(calls, [])
+
+    def test_too_big(self):
+        with self.assertRaises(binmsg.CannotPack):
+            self.producer.write({'type': 1, 'name': 'a' * 64})
+
+    def test_wrap_empty_ring(self):
+        # 40 byte record leaves only 24 bytes to end of ring, 60 byte record
+        # should still fit to empty ring
+        msg = {'type': 1, 'name': 'a' * 27}
+        self.producer.write(msg, timeout=1)
+        self.assertEqual(self.consumer.read(timeout=1), msg)
+        msg = {'type': 2, 'name': 'b' * 47}
+        out = []
+        consumer = threading.Thread(
+                   target=lambda: out.append(self.consumer.read(timeout=2)))
+        consumer.start()
+        self.producer.write(msg, timeout=1)
+        consumer.join()
+        self.assertEqual(out, [msg])
+        self.assertTrue(self.consumer.empty())
+
+    def test_wrap_published_alone(self):
+        self.producer.write({'type': 1, 'name': 'a' * 27})
+        # Wrap is published, but message waits for consumer
+        with self.assertRaises(self.shm.RingFull):
+            self.producer.write({'type': 2, 'name': 'b' * 47}, block=False)
+        self.consumer.read()
+        with self.assertRaises(self.shm.RingEmpty):
+            self.consumer.read(block=False)
+        msg = {'type': 3, 'name': 'c' * 47}
+        self.producer.write(msg, block=False)
+        self.assertEqual(self.consumer.read(block=False), msg)
+
+
+class TestStringDictionary(unittest.TestCase):
+    def setUp(self):
+        defs = [
+            {'name': 'host', 'struct': binmsg.string()},
+            {'name': 'event', 'struct': binmsg.string()},
+            {'name': 'value', 'struct': binmsg.uint()},
+        ]
+        self.binmsg = binmsg.BinMsg(definitions=defs)
+
+    def test_repeated(self):
+        encoder = binmsg.StringDictEncoder(self.binmsg, size=4)
+        decoder = binmsg.StringDictDecoder(self.binmsg, size=4)
+        msg = {'host': 'server.example.com', 'event': 'login', 'value': 1}
+        first = encoder.pack(msg)
+        second = encoder.pack(msg)
+        self.assertEqual(len(second), 4 + 4 + 4 + 4,
+                                    "Repeated strings should be references")
+        self.assertTrue(len(first) > len(second))
+        out1 = decoder.unpack(first)
+        out2 = decoder.unpack(second)
+        self.assertEqual(out1, msg)
+        self.assertEqual(out2, msg)
+        self.assertTrue(out1['host'] is out2['host'],
+                                    "Repeated strings should be same object")
+
+    def test_same_string_twice(self):
+        encoder = binmsg.StringDictEncoder(self.binmsg)
+        decoder = binmsg.StringDictDecoder(self.binmsg)
+        msg = {'host': 'same', 'event': 'same', 'value': 1}
+        size = encoder.packed_size(msg)
+        out = encoder.pack(msg)
+        # Both are sent as literals, references point to earlier messages
+        self.assertEqual(len(out), 4 + 4 + 4 + 4 + 4 + 4)
+        self.assertEqual(size, len(out))
+        self.assertEqual(decoder.unpack(out), msg)
+
+    def test_eviction(self):
+        encoder = binmsg.StringDictEncoder(self.binmsg, size=3)
+        decoder = binmsg.StringDictDecoder(self.binmsg, size=3)
+        names = ['a', 'b', 'a', 'c', 'd', 'e', 'a', 'b', 'e', '', 'f', 'c']
+        for i in range(len(names) - 1):
+            msg = {'host': names[i], 'event': names[i + 1], 'value': i}
+            self.assertEqual(decoder.unpack(encoder.pack(msg)), msg)
+        self.assertEqual(len(encoder.dictionary), 3)
+        self.assertEqual(len(decoder.dictionary), 3)
+
+    def test_pack_into(self):
+        encoder = binmsg.StringDictEncoder(self.binmsg)
+        decoder = binmsg.StringDictDecoder(self.binmsg)
+        buf = bytearray(1024)
+        offset = 0
+        msgs = [{'host': 'h%d' % (i % 3), 'event': 'e', 'value': i}
+                for i in range(10)]
+        for msg in msgs:
+            offset += encoder.pack_into(buf, offset, msg)
+        offset = 0
+        for msg in msgs:
+            size = 4 + struct.unpack_from('!I', buf, offset)[0]
+            self.assertEqual(decoder.unpack(bytes(buf[offset:offset + size])), msg)
+            offset += size
+
+    def test_eviction_within_message(self):
+        encoder = binmsg.StringDictEncoder(self.binmsg, size=1)
+        decoder = binmsg.StringDictDecoder(self.binmsg, size=1)
+        msgs = [{'host': 'old', 'event': 'old', 'value': 1},
+                {'host': 'new', 'event': 'old', 'value': 2},
+                {'host': 'old', 'event': 'new', 'value': 3}]
+        for msg in msgs:
+            self.assertEqual(decoder.unpack(encoder.pack(msg)), msg)
+
+    def _check_failed_pack(self, b, invalid):
+        encoder = binmsg.StringDictEncoder(b)
+        decoder = binmsg.StringDictDecoder(b)
+        msg = {'host': 'hello', 'event': 'x', 'value': 1}
+        self.assertEqual(decoder.unpack(encoder.pack(msg)), msg)
+        with self.assertRaises(binmsg.CannotPack):
+            encoder.pack(invalid)
+        buf = bytearray(1024)
+        with self.assertRaises(binmsg.CannotPack):
+            encoder.pack_into(buf, 0, invalid)
+        for msg in [{'host': 'hello', 'event': 'x', 'value': 2},
+                    {'host': 'other', 'event': 'hello', 'value': 3}]:
+            self.assertEqual(decoder.unpack(encoder.pack(msg)), msg)
+
+    def test_failed_pack_string_limit(self):
+        defs = [{'name': 'host', 'struct': binmsg.String()},
+                {'name': 'event', 'struct': binmsg.String(max_length=4)},
+                {'name': 'value', 'struct': binmsg.uint()}]
+        self._check_failed_pack(binmsg.BinMsg(definitions=defs),
+                    {'host': 'new', 'event': 'toolong', 'value': 1})
+
+    def test_failed_pack_frame_limit(self):
+        b = binmsg.BinMsg(definitions=self.binmsg.definitions,
+                          max_frame_size=32)
+        self._check_failed_pack(b,
+                    {'host': 'new', 'event': 'x' * 32, 'value': 1})
+
+    def test_failed_pack_struct_error(self):
+        defs = [{'name': 'host', 'struct': binmsg.String()},
+                {'name': 'event', 'struct': binmsg.String()},
+                {'name': 'value', 'struct': binmsg.uchar()}]
+        self._check_failed_pack(binmsg.BinMsg(definitions=defs),
+                    {'host': 'new', 'event': 'hello', 'value': 256})
+
+    def test_prepared_stale(self):
+        defs = [{'name': 'h', 'struct': binmsg.String()}]
+        b = binmsg.BinMsg(definitions=defs)
+        encoder = binmsg.StringDictEncoder(b, size=1)
+        decoder = binmsg.StringDictDecoder(b, size=1)
+        self.assertEqual(decoder.unpack(encoder.pack({'h': 'a'})), {'h': 'a'})
+        first = encoder.prepare({'h': 'b'})
+        second = encoder.prepare({'h': 'a'})
+        buf = bytearray(first.size)
+        encoder.pack_prepared_into(buf, 0, first)
+        self.assertEqual(decoder.unpack(bytes(buf)), {'h': 'b'})
+        # 'a' was evicted by first message, second refers to it
+        buf = bytearray(second.size)
+        with self.assertRaises(binmsg.CannotPack):
+            encoder.pack_prepared_into(buf, 0, second)
+        second = encoder.prepare({'h': 'a'})
+        buf = bytearray(second.size)
+        encoder.pack_prepared_into(buf, 0, second)
+        self.assertEqual(decoder.unpack(bytes(buf)), {'h': 'a'})
+
+    def test_failed_unpack(self):
+        encoder = binmsg.StringDictEncoder(self.binmsg)
+        decoder = binmsg.StringDictDecoder(self.binmsg)
+        decoder.unpack(encoder.pack({'host': 'a', 'event': 'b', 'value': 1}))
+        with self.assertRaises(binmsg.CannotUnpack):
+            decoder.unpack(struct.pack('!IIcI', 9, 2, b'c', 5))
+        msg = {'host': 'a', 'event': 'c', 'value': 2}
+        self.assertEqual(decoder.unpack(encoder.pack(msg)), msg)
+
+    def test_length_field_range(self):
+        defs = [{'name': 'host', 'struct': binmsg.String('!B')}]
+        b = binmsg.BinMsg(definitions=defs)
+        with self.assertRaises(ValueError):
+            binmsg.StringDictEncoder(b, size=256)
+        encoder = binmsg.StringDictEncoder(b, size=128)
+        decoder = binmsg.StringDictDecoder(b, size=128)
+        for i in range(200):
+            msg = {'host': 'h%d' % (i % 150)}
+            self.assertEqual(decoder.unpack(encoder.pack(msg)), msg)
+        decoder.unpack(encoder.pack({'host': 'x' * 127}))
+        with self.assertRaises(binmsg.CannotPack):
+            encoder.pack({'host': 'y' * 128})
+
+    def test_unknown_index(self):
+        decoder = binmsg.StringDictDecoder(self.binmsg)
+        msg = struct.pack('!IIII', 12, 1, 3, 1)
+        with self.assertRaises(binmsg.CannotUnpack):
+            decoder.unpack(msg)
+
+
+class TestLengthFormats(unittest.TestCase):
+    def setUp(self):
+        self.defs = [
+            {'name': 'type', 'struct': binmsg.uchar()},
+            {'name': 'name', 'struct': binmsg.string()},
+        ]
+        self.msg = {'type': 1, 'name': 'Test'}
+
+    def test_struct_formats(self):
+        for fmt in ['!B', '!H', '!I', '!Q']:
+            b = binmsg.BinMsg(definitions=self.defs, size_format=fmt)
+            out = b.pack(self.msg)
+            self.assertEqual(struct.pack(fmt, 9) + struct.pack('!BI', 1, 4) + b'Test',
+                             out, "Wrong value for packed message with %s" % fmt)
+            self.assertEqual(b.unpack(out), self.msg)
+            self.assertEqual(b.packed_size(self.msg), len(out))
+
+    def test_invalid_struct_format(self):
+        for fmt in ['!b', '!f', '!2s', '!HH', '']:
+            with self.assertRaises(ValueError):
+                binmsg.BinMsg(definitions=self.defs, size_format=fmt)
+
+    def test_size_format(self):
+        b = binmsg.BinMsg(definitions=self.defs)
+        self.assertEqual(b.size_format.size, 4)
+        self.assertEqual(b.size_length, 4)
+        out = b.pack(self.msg)
+        self.assertEqual(b.length_field.unpack_from(out), (4, 9))
+        self.assertEqual(b.frame_length(out), (4, 9))
+        b = binmsg.BinMsg(definitions=self.defs, size_format='varint')
+        self.assertEqual(b.size_format, None)
+        self.assertEqual(b.size_length, None)
+
+    def test_varint(self):
+        b = binmsg.BinMsg(definitions=self.defs, size_format='varint')
+        out = b.pack(self.msg)
+        self.assertEqual(b'\x09' + struct.pack('!BI', 1, 4) + b'Test', out,
+                                                "Wrong value for packed message")
+        self.assertEqual(b.unpack(out), self.msg)
+        self.assertEqual(b.frame_length(out[:1]), (1, 9))
+        msg = {'type': 1, 'name': 'x' * 300}
+        out = b.pack(msg)
+        self.assertEqual(out[:2], b'\xb1\x02', "Wrong value for varint length")
+        self.assertEqual(b.unpack(out), msg)
+        self.assertEqual(b.frame_length(out[:1]), None)
+        buf = bytearray(b.packed_size(msg))
+        b.pack_into(buf, 0, msg)
+        self.assertEqual(bytes(buf), out)
+
+    def test_no_length(self):
+        b = binmsg.BinMsg(definitions=self.defs, size_format=None)
+        out = b.pack(self.msg)
+        self.assertEqual(struct.pack('!BI', 1, 4) + b'Test', out,
+                                                "Wrong value for packed message")
+        self.assertEqual(b.unpack(out), self.msg)
+
+    def test_length_field_overflow(self):
+        b = binmsg.BinMsg(definitions=self.defs, size_format='!B')
+        with self.assertRaises(binmsg.CannotPack):
+            b.pack({'type': 1, 'name': 'x' * 300})
+
+    def test_max_frame_size(self):
+        b = binmsg.BinMsg(definitions=self.defs, max_frame_size=16)
+        b.unpack(b.pack(self.msg))
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.pack({'type': 1, 'name': 'x' * 12})
+        # Limit is checked from length field before rest of message arrives
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.frame_length(struct.pack('!I', 2 ** 32 - 1))
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.unpack(struct.pack('!I', 17) + b'\0' * 17)
+        b = binmsg.BinMsg(definitions=self.defs, size_format=None,
+                          max_frame_size=16)
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.unpack(b'\0' * 17)
+
+    def test_string_max_length(self):
+        defs = [{'name': 'name', 'struct': binmsg.String(max_length=4)}]
+        b = binmsg.BinMsg(definitions=defs)
+        self.assertEqual(b.unpack(b.pack({'name': 'Test'})), {'name': 'Test'})
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.pack({'name': 'Tests'})
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.pack_into(bytearray(64), 0, {'name': 'Tests'})
+        with self.assertRaises(binmsg.LimitExceeded):
+            b.unpack(struct.pack('!II', 9, 5) + b'Tests')
+        # Corrupt length is not trusted
+        with self.assertRaises(binmsg.CannotUnpack):
+            binmsg.BinMsg(definitions=self.defs).unpack(
+                                    struct.pack('!IBI', 9, 1, 2 ** 30) + b'Test')
+
+
 class TestConditions(unittest.TestCase):
     def test_contains(self):
         defs = [{'name': 'type', 'struct': binmsg.uchar()},